@@ -1,9 +1,12 @@
 import hashlib
+import os
 
 from construct import *
 
 from . import formats
 
+CHECKSUM_CHUNK_SIZE = 1024 * 1024
+
 
 class ParsedFile:
     @staticmethod
@@ -38,6 +41,24 @@ class ParsedFile:
     def checksum(self):
         raise NotImplementedError()
 
+    # Returns the SHA-1 digest of the rest of the binary file object f,
+    # streaming it instead of reading it into memory all at once.
+    @staticmethod
+    def digest_from_fd(f):
+        if hasattr(os, 'posix_fadvise'):
+            try:
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            except OSError:
+                pass
+
+        if hasattr(hashlib, 'file_digest'):
+            return hashlib.file_digest(f, 'sha1').digest()
+
+        h = hashlib.sha1()
+        for chunk in iter(lambda: f.read(CHECKSUM_CHUNK_SIZE), b''):
+            h.update(chunk)
+        return h.digest()
+
 
 class MusicMetadata:
     @staticmethod
@@ -130,8 +130,19 @@ class ChecksumDB:
         self._db[device][inode] = (checksum, metadata_info, metadata_len, mtime)
         self._try_flush()
 
-    def _try_flush(self):
-        self._flush_counter += 1
+    # Like add(), but takes a list of (device, inode, mtime, checksum,
+    # metadata_info, metadata_len) tuples and flushes at most once. Pass
+    # try_flush=False if flush() will be called right after anyway.
+    def add_many(self, items, try_flush=True):
+        for device, inode, mtime, checksum, metadata_info, metadata_len in items:
+            if device not in self._db:
+                self._db[device] = {}
+            self._db[device][inode] = (checksum, metadata_info, metadata_len, mtime)
+        if try_flush:
+            self._try_flush(len(items))
+
+    def _try_flush(self, count=1):
+        self._flush_counter += count
         if self._flush_counter < 50:
             return
         self.flush()
@@ -153,16 +164,24 @@ class Freezetag:
 
     @staticmethod
     def from_path(path):
-        with path.open('rb') as f:
+        with open(path, 'rb') as f:
             return Freezetag.from_bytes(f.read())
 
     def __init__(self, data):
         self.data = data
         self._bytes = None
+        self._file_index = None
 
     # Call this manually if data is changed.
     def data_updated(self):
         self._bytes = None
+        self._file_index = None
+
+    # Returns a dict mapping (checksum, path) to the frozen file state.
+    def file_index(self):
+        if self._file_index is None:
+            self._file_index = {(f.checksum, f.path): f for f in self.data.frozen.files}
+        return self._file_index
 
     def bytes(self):
         if not self._bytes:
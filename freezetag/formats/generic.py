@@ -18,6 +18,9 @@ class ParsedFile(base.ParsedFile):
         pass
 
     def checksum(self):
+        if self._instance is None:
+            with self.path.open('rb') as f:
+                return base.ParsedFile.digest_from_fd(f)
         return hashlib.sha1(self.instance).digest()
 
 
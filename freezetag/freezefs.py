@@ -1,18 +1,20 @@
 #!/usr/bin/env python3
 
-import gc
+import heapq
 import os
 import platform
 import sys
 import time
-from collections import OrderedDict
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from errno import ENOENT
-from pathlib import Path
+from operator import attrgetter
+from pathlib import Path, PurePosixPath
 from stat import S_IFDIR
-from threading import Lock, Timer
+from threading import Condition, Lock, RLock, Thread, Timer, current_thread
 
 from appdirs import user_cache_dir
-from watchdog.events import FileSystemEventHandler
+from watchdog.events import FileModifiedEvent, FileSystemEventHandler
 from watchdog.observers import Observer
 
 from .base import FuseFile, MusicMetadata, ParsedFile
@@ -32,12 +34,25 @@ except:
 
 FREEZETAG_CACHE_LIMIT = 10
 FREEZETAG_KEEPALIVE_TIME = 10
+STAT_CACHE_TIME = 1
+# Each worker holds a whole music file in memory (twice, while checksumming)
+# and parsing is mostly GIL-bound Python, so only a few workers are used to
+# overlap disk reads.
+SCAN_WORKERS = 4
+DB_BATCH_SIZE = 1000
+REF_LOCK_COUNT = 16
+MODIFY_DEBOUNCE_TIME = 0.5
 CACHE_DIR = Path(user_cache_dir('freezetag', 'x1ppy'))
 
 ST_ITEMS = ['st_atime', 'st_ctime', 'st_gid', 'st_mode', 'st_mtime', 'st_nlink', 'st_size', 'st_uid']
 if platform.system() == 'Darwin':
     ST_ITEMS.append('st_birthtime')
 
+# (key, getter) pairs for the ST_ITEMS this platform's stat results provide.
+ST_GETTERS = tuple((key, attrgetter(key)) for key in ST_ITEMS if hasattr(os.stat_result, key))
+
+_MISS = object()
+
 
 # An LRU cache with mostly standard behavior besides one thing: it asks whether
 # an item can be purged before doing so. This prevents the cache from purging
@@ -45,35 +60,68 @@ if platform.system() == 'Darwin':
 # needlessly recreated in memory if another file with the same freezetag is
 # opened. This also means the cache could technically expand past its maxsize
 # if all items cannot be purged.
-class PoliteLRUCache(OrderedDict):
-    def __init__(self, getter, can_purge, maxsize=128, *args, **kwds):
+#
+# The cache is thread-safe. getter is called without holding the cache lock so
+# that a slow load doesn't block lookups of other keys, while can_purge is
+# called with the lock held.
+class PoliteLRUCache:
+    def __init__(self, getter, can_purge, maxsize=128):
         self.maxsize = maxsize
         self.getter = getter
         self.can_purge = can_purge
-        super().__init__(*args, **kwds)
-
-    def __getitem__(self, key):
-        if key not in self:
-            self.__setitem__(key, self.getter(key))
-        value = super().__getitem__(key)
-        self.move_to_end(key)
+        # Plain dicts preserve insertion order, so the first key is always the
+        # least recently used one.
+        self._d = {}
+        self._lock = Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._d
+
+    def __len__(self):
+        with self._lock:
+            return len(self._d)
+
+    def get_or_load(self, key):
+        with self._lock:
+            value = self._d.pop(key, _MISS)
+            if value is not _MISS:
+                self._d[key] = value
+                return value
+
+        value = self.getter(key)
+
+        with self._lock:
+            # Another thread may have loaded the same key in the meantime.
+            loaded = self._d.pop(key, _MISS)
+            if loaded is not _MISS:
+                value = loaded
+            self._d[key] = value
+            if len(self._d) > self.maxsize:
+                self._evict()
         return value
 
-    def __setitem__(self, key, value):
-        super().__setitem__(key, value)
-        if len(self) > self.maxsize:
-            for i in range(len(self) - 1):
-                oldest = next(iter(self))
-                if self.can_purge(oldest):
-                    del self[oldest]
-                    break
-                self.move_to_end(oldest)
+    def discard(self, key):
+        with self._lock:
+            self._d.pop(key, None)
+
+    def _evict(self):
+        d = self._d
+        for i in range(len(d) - 1):
+            oldest = next(iter(d))
+            if self.can_purge(oldest):
+                del d[oldest]
+                break
+            d[oldest] = d.pop(oldest)
 
 
 class FrozenItemFreezetagEntry:
-    def __init__(self, freezetag_path, path, metadata_len):
+    def __init__(self, freezetag_path, path, target_path, metadata_len):
         self.freezetag_path = freezetag_path
+        # The FUSE path of the entry, e.g. "/root/dir/file.flac".
         self.path = path
+        # The path of the entry relative to the freezetag root, e.g. "dir/file.flac".
+        self.target_path = target_path
         self.metadata_len = metadata_len
 
 
@@ -82,22 +130,46 @@ class FrozenItemFileEntry:
         self.path = path
         self.metadata_info = metadata_info
         self.metadata_len = metadata_len
+        self._stat = None
+        self._stat_time = 0
+
+    # Returns the stat items of the underlying file. These are cached for a
+    # short while since FUSE tends to request them several times in a row.
+    def stat(self):
+        now = time.monotonic()
+        if self._stat is None or now - self._stat_time >= STAT_CACHE_TIME:
+            st = os.stat(self.path)
+            self._stat = {key: getter(st) for key, getter in ST_GETTERS}
+            self._stat_time = now
+        return self._stat
+
+    def stat_updated(self):
+        self._stat = None
 
 
 class FrozenItem:
     def __init__(self, checksum):
         self.checksum = checksum
-        self.freezetags = []
-        self.files = []
+        # Maps FUSE paths to FrozenItemFreezetagEntry.
+        self.freezetags = {}
+        # Maps absolute file paths to FrozenItemFileEntry.
+        self.files = {}
 
 class FreezeFS(Operations, FileSystemEventHandler):
     def __init__(self, verbose=False, db_path=None):
-        self.path_map = {Path('/').root: {}}
+        # Maps every mounted file path to its FrozenItem.
+        self.path_index = {}
+        # Maps every mounted directory path to its children, keyed by name. A
+        # child is either a FrozenItem or the children dict of a subdirectory.
+        self.dir_children = {'/': {}}
+        # Maps directory paths to the names readdir returns for them. Entries
+        # are dropped whenever a child is added, removed or changes visibility.
+        self._readdir_cache = {}
+        self._readdir_generation = 0
         self.checksum_map = {}
         self.abs_path_map = {}
         self.freezetag_map = {}
         self.inactive_freezetags = []
-        self.freezetag_ref_lock = Lock()
         self.fh_map = {}
         self.verbose = verbose
 
@@ -118,11 +190,30 @@ class FreezeFS(Operations, FileSystemEventHandler):
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
         self.checksum_db = ChecksumDB(self.db_path)
 
-        # self.freezetag_ref_lock must be acquired before accessing.
         self.freezetag_cache = PoliteLRUCache(Freezetag.from_path, self._can_purge_ftag, FREEZETAG_CACHE_LIMIT)
 
-        # self.freezetag_ref_lock must be acquired before accessing.
-        self.freezetag_refs = {}
+        # Map freezetag paths to the number of open files using them and to
+        # their latest purge deadline. The lock returned by self._ref_lock(path)
+        # must be acquired before accessing the entries for a path.
+        self._ref_counts = defaultdict(int)
+        self._purge_deadlines = {}
+        self._ref_locks = [Lock() for i in range(REF_LOCK_COUNT)]
+
+        # A heap of (deadline, freezetag path) consumed by the purge thread.
+        # Entries are never removed when a purge is rescheduled; the thread
+        # checks the latest deadline in self._purge_deadlines instead.
+        self._purge_heap = []
+        self._purge_cv = Condition()
+        Thread(target=self._purge_loop, daemon=True).start()
+
+        # Watchdog events are handled one at a time, whether they come from the
+        # observer or from a debounced modification.
+        self._event_lock = RLock()
+
+        # Maps file paths to the Timer of their pending modification.
+        # self._modify_lock must be acquired before accessing.
+        self._pending_modify = {}
+        self._modify_lock = Lock()
 
         now = time.time()
 
@@ -159,11 +250,47 @@ class FreezeFS(Operations, FileSystemEventHandler):
         observer.start()
 
         print(f"Scanning {directory} for files and freezetags...")
-        for path in walk_dir(directory):
-            if path.suffix.lower() == '.ftag':
-                self._add_ftag(path)
-            else:
-                self._add_file(path)
+        ftag_paths = []
+        pending = []
+        for dir_entry in walk_dir(directory):
+            if dir_entry.name.lower().endswith('.ftag'):
+                ftag_paths.append(Path(dir_entry.path))
+                continue
+            # Don't use DirEntry.stat(): on Windows it leaves st_dev and st_ino
+            # at 0, and those key the checksum database.
+            path = Path(dir_entry.path)
+            st = self._stat_file(path)
+            if not st:
+                continue
+            if not self._add_cached_file(path, st):
+                pending.append((path, st))
+
+        # Parsing and checksumming new files is mostly spent reading them, so
+        # overlap that work across threads. Results are still added in walk
+        # order on this thread, and written to the database in batches.
+        db_items = []
+        with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as executor:
+            futures = [executor.submit(parse_file, path) for path, st in pending]
+            try:
+                for (path, st), future in zip(pending, futures):
+                    parsed = future.result()
+                    if not parsed:
+                        continue
+                    self._add_parsed_file(path, parsed)
+                    db_items.append((st.st_dev, st.st_ino, st.st_mtime, *parsed))
+                    if len(db_items) >= DB_BATCH_SIZE:
+                        self.checksum_db.add_many(db_items)
+                        db_items = []
+            except:
+                for future in futures:
+                    future.cancel()
+                raise
+
+        # Freezetags are added last, but still in walk order so that the first
+        # freezetag found for a given root wins.
+        for path in ftag_paths:
+            self._add_ftag(path)
+        self.checksum_db.add_many(db_items, try_flush=False)
         self.checksum_db.flush()
 
         print(f'mounting {mount_point}')
@@ -192,17 +319,24 @@ class FreezeFS(Operations, FileSystemEventHandler):
         else:
             item = self.checksum_map[checksum]
 
-        item.freezetags.append(entry)
+        item.freezetags[entry.path] = entry
 
-        assert (not self._get_item(entry.path))
+        path = entry.path
+        assert (not self._get_item(path))
 
-        map = self.path_map
-        parts = Path(entry.path).parts
-        for part in parts[0:-1]:
-            if part not in map:
-                map[part] = {}
-            map = map[part]
-        map[parts[-1]] = item
+        self.path_index[path] = item
+        child = item
+        while path != '/':
+            parent, name = _split_path(path)
+            parent, name = _ip(parent), _ip(name)
+            siblings = self.dir_children.get(parent)
+            if siblings is not None:
+                siblings[name] = child
+                self._invalidate_readdir(parent)
+                break
+            siblings = self.dir_children[parent] = {name: child}
+            self._invalidate_readdir(parent)
+            child, path = siblings, parent
 
     def _add_path_entry(self, checksum, entry):
         if checksum not in self.checksum_map:
@@ -211,33 +345,41 @@ class FreezeFS(Operations, FileSystemEventHandler):
         else:
             item = self.checksum_map[checksum]
 
-        item.files.append(entry)
-        self.abs_path_map[entry.path] = item
+        became_visible = not len(item.files)
+
+        key = _ip(entry.path)
+        item.files[key] = entry
+        self.abs_path_map[key] = item
+
+        if became_visible:
+            for fuse_path in item.freezetags:
+                self._invalidate_readdir(_split_path(fuse_path)[0])
+
+    # Must be called after the change to the directory, see readdir.
+    def _invalidate_readdir(self, dir_path):
+        self._readdir_generation += 1
+        self._readdir_cache.pop(dir_path, None)
 
     def _get_item(self, path):
-        item = self.path_map
-        for part in Path(path).parts:
-            if part not in item:
-                return None
-            item = item[part]
-        return item
+        return self.path_index.get(path) or self.dir_children.get(path)
 
     def _add_ftag(self, path):
-        self.freezetag_ref_lock.acquire()
+        # Normalize the same way the watchdog handlers do, so that a freezetag
+        # found during the scan has the same key as in later events.
+        path = _ip(Path(path))
         try:
-            freezetag = self.freezetag_cache[path]
-            self._schedule_purge_ftag(path)
+            freezetag = self.freezetag_cache.get_or_load(path)
         except KeyboardInterrupt:
             raise
         except:
             print(f'cannot parse freezetag: {path}')
             return
-        finally:
-            self.freezetag_ref_lock.release()
+
+        self._schedule_purge_ftag(path)
 
         self._log_verbose(f'adding freezetag: {path}')
 
-        root = Path('/') / freezetag.data.frozen.root
+        root = _ip(PurePosixPath('/', freezetag.data.frozen.root).as_posix())
         item = self._get_item(root)
         if item:
             print(f'cannot mount {path} to {root}: path already mounted by another freezetag')
@@ -247,104 +389,148 @@ class FreezeFS(Operations, FileSystemEventHandler):
         self.freezetag_map[path] = freezetag_map = (root, [])
 
         for state in freezetag.data.frozen.files:
-            fuse_path = Path('/') / freezetag.data.frozen.root / state.path
+            fuse_path = _ip(PurePosixPath(root, state.path).as_posix())
             metadata = MusicMetadata.from_state(state)
-            metadata_len = sum(m[1] for m in metadata) if metadata else 0
-            entry = FrozenItemFreezetagEntry(path, fuse_path, metadata_len)
+            metadata_len = metadata.size if metadata else 0
+            entry = FrozenItemFreezetagEntry(path, fuse_path, state.path, metadata_len)
             self._add_freezetag_entry(state.checksum, entry)
             freezetag_map[1].append(state.checksum)
 
     def _add_file(self, src):
+        st = self._stat_file(src)
+        if not st or self._add_cached_file(src, st):
+            return
+
+        parsed = parse_file(src)
+        if parsed:
+            self.checksum_db.add(st.st_dev, st.st_ino, st.st_mtime, *parsed)
+            self._add_parsed_file(src, parsed)
+
+    def _stat_file(self, src):
         try:
-            st = src.stat()
+            return src.stat()
         except:
             print(f'cannot stat file: {src}')
-            return
+            return None
 
+    def _add_cached_file(self, src, st):
         cached = self.checksum_db.get(st.st_dev, st.st_ino, st.st_mtime)
-        if cached:
-            self._log_verbose(f'adding cached file: {src}')
-            checksum, metadata_info, metadata_len, mtime = cached
-            entry = FrozenItemFileEntry(src, metadata_info, metadata_len)
-            self._add_path_entry(checksum, entry)
-            return
+        if not cached:
+            return False
 
-        file = ParsedFile.from_path(src)
-        try:
-            file.parse()
-        except KeyboardInterrupt:
-            raise
-        except:
-            print(f'cannot parse file: {src}')
-            return
+        self._log_verbose(f'adding cached file: {src}')
+        checksum, metadata_info, metadata_len, mtime = cached
+        entry = FrozenItemFileEntry(src, metadata_info, metadata_len)
+        self._add_path_entry(checksum, entry)
+        return True
 
+    # Adds a file from the result of parse_file(). The caller is responsible
+    # for adding it to self.checksum_db.
+    def _add_parsed_file(self, src, parsed):
         self._log_verbose(f'adding new file: {src}')
 
-        metadata = file.strip()
-        metadata_info = list(metadata) if metadata else []
-        metadata_len = sum(m[1] for m in metadata_info) if metadata else 0
-        checksum = file.checksum()
+        checksum, metadata_info, metadata_len = parsed
         entry = FrozenItemFileEntry(src, metadata_info, metadata_len)
-        self.checksum_db.add(st.st_dev, st.st_ino, st.st_mtime, checksum, metadata_info, metadata_len)
         self._add_path_entry(checksum, entry)
 
     def _delete_if_dangling(self, item, fuse_path, file_path):
         if not len(item.freezetags) and not len(item.files):
             del self.checksum_map[item.checksum]
 
-        if fuse_path and not any(entry.path == fuse_path for entry in item.freezetags):
-            map = self.path_map
-            parents = []
-            for part in Path(fuse_path).parts:
-                parents.append((part, map))
-                map = map[part]
-            while len(parents):
-                part, parent = parents.pop()
-                del parent[part]
-                if len(parent):
+        if fuse_path and fuse_path not in item.freezetags:
+            path = fuse_path
+            del self.path_index[path]
+            while path != '/':
+                parent, name = _split_path(path)
+                siblings = self.dir_children[parent]
+                del siblings[name]
+                self._invalidate_readdir(parent)
+                if len(siblings) or parent == '/':
                     break
+                del self.dir_children[parent]
+                path = parent
 
         if file_path and not len(item.files):
-            del self.abs_path_map[file_path]
+            del self.abs_path_map[str(file_path)]
+            # The item's freezetag entries become hidden.
+            for fuse_path in item.freezetags:
+                self._invalidate_readdir(_split_path(fuse_path)[0])
 
-    def _can_purge_ftag(self, path):
-        assert (self.freezetag_ref_lock.locked())
+    def _ref_lock(self, path):
+        return self._ref_locks[hash(path) % REF_LOCK_COUNT]
 
-        if path not in self.freezetag_refs:
-            return True
-        return self.freezetag_refs[path][1] <= 0
+    def _bump_ref(self, path, delta):
+        lock = self._ref_lock(path)
+        lock.acquire()
+        try:
+            self._ref_counts[path] += delta
+        finally:
+            lock.release()
+
+    # Called by self.freezetag_cache with its lock held, so the cache must
+    # never be accessed while holding a ref lock.
+    def _can_purge_ftag(self, path):
+        lock = self._ref_lock(path)
+        lock.acquire()
+        try:
+            return self._ref_counts.get(path, 0) <= 0
+        finally:
+            lock.release()
 
     def _purge_ftag(self, path, force):
-        self.freezetag_ref_lock.acquire()
+        lock = self._ref_lock(path)
+        lock.acquire()
         try:
-            no_refs = path in self.freezetag_refs and self.freezetag_refs[path][1] <= 0
-            if (force or no_refs) and path in self.freezetag_cache:
-                del self.freezetag_cache[path]
-                gc.collect()
-            if no_refs and path in self.freezetag_refs:
-                del self.freezetag_refs[path]
+            no_refs = self._ref_counts.get(path, 0) <= 0
+            if not force:
+                # Skip purges that have been rescheduled since.
+                deadline = self._purge_deadlines.get(path)
+                no_refs = no_refs and deadline is not None and deadline <= time.monotonic()
+            if no_refs:
+                self._ref_counts.pop(path, None)
+                self._purge_deadlines.pop(path, None)
         finally:
-            self.freezetag_ref_lock.release()
+            lock.release()
+
+        if force or no_refs:
+            self.freezetag_cache.discard(path)
 
     def _schedule_purge_ftag(self, path):
-        assert (self.freezetag_ref_lock.locked())
+        deadline = time.monotonic() + FREEZETAG_KEEPALIVE_TIME
 
-        t = Timer(FREEZETAG_KEEPALIVE_TIME, lambda: self._purge_ftag(path, force=False))
-        t.start()
+        lock = self._ref_lock(path)
+        lock.acquire()
+        try:
+            self._purge_deadlines[path] = deadline
+        finally:
+            lock.release()
 
-        if not path in self.freezetag_refs:
-            self.freezetag_refs[path] = [t, 0]
-        else:
-            timer = self.freezetag_refs[path][0]
-            timer and timer.cancel()
-            self.freezetag_refs[path][0] = t
+        self._purge_cv.acquire()
+        try:
+            heapq.heappush(self._purge_heap, (deadline, path))
+            self._purge_cv.notify()
+        finally:
+            self._purge_cv.release()
+
+    def _purge_loop(self):
+        while True:
+            self._purge_cv.acquire()
+            try:
+                while True:
+                    timeout = self._purge_heap[0][0] - time.monotonic() if self._purge_heap else None
+                    if timeout is not None and timeout <= 0:
+                        break
+                    self._purge_cv.wait(timeout)
+                deadline, path = heapq.heappop(self._purge_heap)
+            finally:
+                self._purge_cv.release()
+
+            self._purge_ftag(path, force=False)
 
     # Filesystem methods
     # ==================
 
     def getattr(self, path, fh=None):
-        path = Path(path)
-
         item = self._get_item(path)
         if item == None:
             raise FuseOSError(ENOENT)
@@ -353,49 +539,49 @@ class FreezeFS(Operations, FileSystemEventHandler):
             if not len(item.freezetags) or not len(item.files):
                 raise FuseOSError(ENOENT)
 
-            file_entry = item.files[0]
-            frozen_entry = None
-            for entry in item.freezetags:
-                if entry.path == path:
-                    frozen_entry = entry
-                    break
-
+            file_entry = next(iter(item.files.values()))
+            frozen_entry = item.freezetags.get(path)
             if not frozen_entry:
                 raise FuseOSError(ENOENT)
 
-            st = file_entry.path.stat()
-            d = {key: getattr(st, key) for key in ST_ITEMS}
+            d = dict(file_entry.stat())
             d['st_size'] += frozen_entry.metadata_len - file_entry.metadata_len
             return d
 
         return self.dir_stat
 
     def readdir(self, path, fh):
-        yield '.'
-        yield '..'
+        names = self._readdir_cache.get(path)
+        if names is not None:
+            return names
+
+        generation = self._readdir_generation
+        names = ['.', '..']
         for name, item in self._get_item(path).items():
             if isinstance(item, FrozenItem) and (not len(item.freezetags) or not len(item.files)):
                 continue
-            yield name
+            names.append(name)
+
+        # A change that raced with the listing invalidates after it's made, so
+        # either it pops the entry stored here or it bumped the generation
+        # before the check below, in which case the entry is dropped.
+        self._readdir_cache[path] = names
+        if generation != self._readdir_generation:
+            self._readdir_cache.pop(path, None)
+        return names
 
     # File methods
     # ============
 
     def open(self, path, flags):
-        path = Path(path)
         item = self._get_item(path)
         if not item:
             raise FuseOSError(ENOENT)
 
         # As long as the raw checksum matches, any file should work, so just use the first one we have.
-        file_entry = item.files[0]
-
-        frozen_entry = None
-        for entry in item.freezetags:
-            if entry.path == path:
-                frozen_entry = entry
-                break
+        file_entry = next(iter(item.files.values()))
 
+        frozen_entry = item.freezetags.get(path)
         if not frozen_entry:
             raise FuseOSError(ENOENT)
 
@@ -404,19 +590,12 @@ class FreezeFS(Operations, FileSystemEventHandler):
         if frozen_entry.metadata_len:
             freezetag_path = frozen_entry.freezetag_path
 
-            self.freezetag_ref_lock.acquire()
-            try:
-                if freezetag_path not in self.freezetag_refs:
-                    self.freezetag_refs[freezetag_path] = [None, 0]
-                self.freezetag_refs[freezetag_path][1] += 1
-                freezetag = self.freezetag_cache[freezetag_path]
-            finally:
-                self.freezetag_ref_lock.release()
+            self._bump_ref(freezetag_path, 1)
+            freezetag = self.freezetag_cache.get_or_load(freezetag_path)
 
-            for f in freezetag.data.frozen.files:
-                if f.checksum == item.checksum:
-                    metadata = f.metadata
-                    break
+            state = freezetag.file_index().get((item.checksum, frozen_entry.target_path))
+            if state:
+                metadata = state.metadata
 
         file = FuseFile.from_info(file_entry.path, flags, metadata, file_entry.metadata_info, file_entry.metadata_len,
                                   frozen_entry.metadata_len)
@@ -430,12 +609,8 @@ class FreezeFS(Operations, FileSystemEventHandler):
         f, freezetag_path = self.fh_map[fh]
 
         if freezetag_path:
-            self.freezetag_ref_lock.acquire()
-            try:
-                self.freezetag_refs[freezetag_path][1] -= 1
-                self._schedule_purge_ftag(freezetag_path)
-            finally:
-                self.freezetag_ref_lock.release()
+            self._bump_ref(freezetag_path, -1)
+            self._schedule_purge_ftag(freezetag_path)
 
         del self.fh_map[fh]
         return f.close()
@@ -443,7 +618,46 @@ class FreezeFS(Operations, FileSystemEventHandler):
     # watchdog observers
     # ==================
 
+    def dispatch(self, event):
+        with self._event_lock:
+            super().dispatch(event)
+
+    # Cancels the pending modification of path, if any, and returns whether
+    # there was one.
+    def _cancel_modify(self, path):
+        with self._modify_lock:
+            timer = self._pending_modify.pop(path, None)
+        timer and timer.cancel()
+        return timer is not None
+
+    def _schedule_modify(self, event):
+        timer = Timer(MODIFY_DEBOUNCE_TIME, self._do_modify, args=(event,))
+        timer.daemon = True
+        with self._modify_lock:
+            previous = self._pending_modify.get(event.src_path)
+            previous and previous.cancel()
+            self._pending_modify[event.src_path] = timer
+        timer.start()
+
+    def _do_modify(self, event):
+        with self._modify_lock:
+            # Bail if this modification was superseded by a newer one.
+            if self._pending_modify.get(event.src_path) is not current_thread():
+                return
+            del self._pending_modify[event.src_path]
+
+        with self._event_lock:
+            self.on_deleted(event)
+            self.on_created(event)
+
     def on_moved(self, event):
+        # A file that is modified and then renamed (e.g. by a tagger) still
+        # needs to be re-added, just under its new path. The modification
+        # can't run before the move is handled since both hold
+        # self._event_lock.
+        if self._cancel_modify(event.src_path):
+            self._schedule_modify(FileModifiedEvent(event.dest_path))
+
         src = Path(event.src_path)
         dst = Path(event.dest_path)
         if dst.is_dir():
@@ -452,6 +666,7 @@ class FreezeFS(Operations, FileSystemEventHandler):
         self._log_verbose(f'moved: {src} to {dst}')
 
         if src.suffix.lower() == '.ftag':
+            src, dst = _ip(src), _ip(dst)
             self._purge_ftag(src, force=True)
 
             freezetag_map = self.freezetag_map.get(src)
@@ -467,19 +682,20 @@ class FreezeFS(Operations, FileSystemEventHandler):
 
             for checksum in freezetag_map[1]:
                 item = self.checksum_map[checksum]
-                for entry in item.freezetags:
+                for entry in item.freezetags.values():
                     if entry.freezetag_path == src:
                         entry.freezetag_path = dst
                         break
             return
 
-        item = self.abs_path_map[src]
-        del self.abs_path_map[src]
-        self.abs_path_map[dst] = item
+        item = self.abs_path_map.pop(str(src))
+        self.abs_path_map[_ip(dst)] = item
 
-        for entry in item.files:
-            if entry.path == src:
-                entry.path = dst
+        entry = item.files.pop(str(src), None)
+        if entry:
+            entry.path = dst
+            entry.stat_updated()
+            item.files[_ip(dst)] = entry
 
     def on_created(self, event):
         path = Path(event.src_path)
@@ -493,24 +709,24 @@ class FreezeFS(Operations, FileSystemEventHandler):
         self._add_file(path)
 
     def on_deleted(self, event):
+        self._cancel_modify(event.src_path)
+
         path = Path(event.src_path)
 
         if path.suffix.lower() != '.ftag':
             self._log_verbose(f'deleting file {path}')
 
-            item = self.abs_path_map.get(path)
+            item = self.abs_path_map.get(str(path))
             if not item:
                 return
 
-            for entry in item.files:
-                if entry.path == path:
-                    item.files.remove(entry)
-                    self._delete_if_dangling(item, fuse_path=None, file_path=path)
-                    break
+            if item.files.pop(str(path), None):
+                self._delete_if_dangling(item, fuse_path=None, file_path=path)
             return
 
         self._log_verbose(f'deleting freezetag {path}')
 
+        path = _ip(path)
         self._purge_ftag(path, force=True)
 
         freezetag_map = self.freezetag_map.get(path)
@@ -523,9 +739,9 @@ class FreezeFS(Operations, FileSystemEventHandler):
 
         for checksum in freezetag_map[1]:
             item = self.checksum_map[checksum]
-            for entry in item.freezetags:
+            for fuse_path, entry in item.freezetags.items():
                 if entry.freezetag_path == path:
-                    item.freezetags.remove(entry)
+                    del item.freezetags[fuse_path]
                     self._delete_if_dangling(item, fuse_path=entry.path, file_path=None)
                     break
         del self.freezetag_map[path]
@@ -537,13 +753,67 @@ class FreezeFS(Operations, FileSystemEventHandler):
                 self._add_ftag(tag[1])
                 break
 
+    # Files being written usually produce a burst of modified events, so the
+    # file is only re-added once no new event arrived for MODIFY_DEBOUNCE_TIME.
     def on_modified(self, event):
-        self.on_deleted(event)
-        self.on_created(event)
-
+        if event.is_directory:
+            return
 
+        self._schedule_modify(event)
+
+
+# Returns (checksum, metadata_info, metadata_len) for the file at src, or None
+# if it couldn't be parsed. This is safe to call from worker threads.
+def parse_file(src):
+    file = ParsedFile.from_path(src)
+    try:
+        # Only music files have metadata to strip; everything else is just
+        # checksummed. strip() parses the file into file.instance, which
+        # checksum() then reuses.
+        metadata_info = []
+        metadata_len = 0
+        if file.format:
+            metadata = file.strip()
+            metadata_info = list(metadata)
+            metadata_len = metadata.size
+        return file.checksum(), metadata_info, metadata_len
+    except KeyboardInterrupt:
+        raise
+    except:
+        print(f'cannot parse file: {src}')
+        return None
+
+
+# Yields an os.DirEntry for every file under path, in the same order as a
+# sorted os.walk().
 def walk_dir(path):
-    for dirpath, dirnames, filenames in os.walk(path):
-        dirnames.sort()
-        for filename in sorted(filenames):
-            yield Path(dirpath) / filename
+    stack = [os.fspath(path)]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError:
+            continue
+
+        dirs = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if not is_dir:
+                yield entry
+            elif not entry.is_symlink():
+                dirs.append(entry.path)
+        stack.extend(reversed(dirs))
+
+
+# Interns a path string that will be kept as a dict key, so that the many
+# copies of the same path share one object and compare by identity.
+def _ip(path):
+    return sys.intern(os.fspath(path))
+
+
+def _split_path(path):
+    parent, name = path.rsplit('/', 1)
+    return parent or '/', name